@@ -5,6 +5,7 @@
 
 import local
 from os import fstat
+from stat import S_ISREG
 from sys import exit, modules, stderr, stdin, stdout
 from argparse import ArgumentParser, FileType
 from traceback import format_exc
@@ -56,11 +57,14 @@ def main():
         with args.output as outfp:
             with args.input as infp:
                 btime = -1
+                instat = fstat(infp.fileno())
                 if args.logtime and infp.name != '<stdin>':
-                    instat = fstat(infp.fileno())
                     btime = instat.st_ctime
+                # a log file is replayed at once: no need to flush each line
+                buffered = S_ISREG(instat.st_mode)
                 try:
-                    formatter = formatters[args.format](outfp, basetime=btime)
+                    formatter = formatters[args.format](outfp, basetime=btime,
+                                                        buffered=buffered)
                 except ImportError:
                     raise ValueError("No such filter: %s" % args.format)
 
@@ -69,10 +73,7 @@ def main():
                     exit(0)
 
                 formatter.start()
-                while True:
-                    line = infp.readline()
-                    if not line:
-                        break
+                for line in infp:
                     try:
                         formatter.inject(line)
                     except Exception:
@@ -41,6 +41,20 @@ LEVELS = {'C': (1, '[CHAT]  ', DEBUG),
           '>': (0, '> ', DEBUG),
           '<': (0, '< ', DEBUG),
           '.': (6, '[?????] ', DEBUG)}
+# level lookup table, including the "no level" entry, and the fallback entry
+# for unknown levels. Level strings embed the separator from the message.
+LEVEL_INFO = {lvl: (num, '%s ' % lvlstr, lvllog)
+              for lvl, (num, lvlstr, lvllog) in LEVELS.items()}
+LEVEL_INFO[None] = (0, ' ', DEBUG)
+LEVEL_DEFAULT = LEVEL_INFO['F']
+# prebuilt thread id prefixes and indentation strings for the common cases
+TID_PREFIXES = {tid: '#%02d ' % tid for tid in range(256)}
+TID_PREFIXES[None] = ''
+INDENTS = tuple(' ' * width for width in range(128))
+# trace counter values, as emitted by the target
+HEX_BYTES = {'%02x' % value: value for value in range(256)}
+# chars that may start a trace prefix (tick, count, thread or level)
+PREFIX_CHARS = frozenset('^:{' + ''.join(LEVELS))
 TIME_RE = r'(?:\^(?P<tick>[0-9a-f]{8})\s)?'
 COUNT_RE = r'(?::(?P<count>[0-9a-f]{2})\s)?'
 THREAD_RE = r'(?:{(?P<thread>\d{2,})\}\s)?'
@@ -49,6 +63,7 @@ FUNC_RE = r'(?:(?P<comp>[\w\d_]+)\[(?P<line>\d+)\]\s(?P<func>[\w\d_]+)\(\))?'
 MSG_RE = r'\s*(?P<msg>.*)'
 PARTS_RE = (TIME_RE, COUNT_RE, THREAD_RE, LEVEL_RE, FUNC_RE, MSG_RE)
 LINE_RE = r''.join(PARTS_RE)+r'$'
+PERIOD_RE = r'(?<!\S)(?:(?P<us>\d+(?:\.\d+)?)\s?us|(?P<hz>\d+)\s?Hz)$'
 
 
 class BaseFormatter:
@@ -59,12 +74,28 @@ class BaseFormatter:
     """
 
     LINECRE = re_compile(LINE_RE)
-
-    def __init__(self, output, outdir=None, basetime=None):
+    TIMECRE = re_compile(TIME_RE)
+    COUNTCRE = re_compile(COUNT_RE)
+    THREADCRE = re_compile(THREAD_RE)
+    LEVELCRE = re_compile(LEVEL_RE)
+    FUNCCRE = re_compile(FUNC_RE)
+    PERIODCRE = re_compile(PERIOD_RE)
+    # Amount of queued output that triggers a write, in buffered mode
+    FLUSH_SIZE = 64 << 10
+
+    def __init__(self, output, outdir=None, basetime=None, buffered=False):
         # Output stream
         self._out = output
+        # Pending output chunks, and their overall length
+        self._outbuf = []
+        self._outlen = 0
+        # Whether output may be held back till FLUSH_SIZE is queued, rather
+        # than be flushed line by line (off-line replay only)
+        self._buffered = buffered
         # Thread stacks
         self._stacks = {}
+        # Indentation level of each thread, updated on stack changes
+        self._indents = {}
         # Current indentation level
         self._indent = 0
         # Tick period in seconds
@@ -73,6 +104,8 @@ class BaseFormatter:
         self._basetime = basetime
         # Start time on the host
         self._start_time = 0
+        # Last formatted second, as (second, 'HH:MM:SS')
+        self._last_hms = (None, '')
         # MIME filter
         self._filtermime = FilterMime(outdir)
         # trace counter
@@ -86,9 +119,7 @@ class BaseFormatter:
         """Returns the stack size of any registered thread
         :tid: the thread ID, as a decimal value
         return the number of method stacked into the thread trace stack"""
-        if tid is None or tid not in self._stacks:
-            return 0
-        return len(self._stacks[tid])
+        return len(self._stacks.get(tid, ()))
 
     def _stackpush(self, tid, function):
         """Pushes a new method on top of a thread trace stack
@@ -96,25 +127,62 @@ class BaseFormatter:
         :function: the name of the method, as a string"""
         if tid is None:
             return
-        if tid not in self._stacks:
-            self._stacks[tid] = list()
-        self._stacks[tid].append(function)
+        stack = self._stacks.setdefault(tid, [])
+        stack.append(function)
+        self._indents[tid] = 2*(len(stack)-1)
 
     def _stackpop(self, tid):
         """Pops a method from the top of a thread trace stack
         :tid: the thread ID, as a decimal value
         return the name of the method, as a string"""
-        if tid is None or tid not in self._stacks or not self._stacks[tid]:
+        try:
+            stack = self._stacks[tid]
+            function = stack.pop()
+        except (KeyError, IndexError):
             return ''
-        return self._stacks[tid].pop()
+        self._indents[tid] = 2*(len(stack)-1)
+        return function
 
     def _stacktop(self, tid):
         """Provides the top element of a thread trace trace
         :tid: the thread ID, as a decimal value
         return the name of the method, as a string"""
-        if tid is None or tid not in self._stacks or not self._stacks[tid]:
+        try:
+            return self._stacks[tid][-1]
+        except (KeyError, IndexError):
             return ''
-        return self._stacks[tid][-1]
+
+    @classmethod
+    def _parse_line(cls, string):
+        """Split a trace line into its optional prefix fields.
+        Each prefix is only matched when the leading char at the current
+        position may start it, so plain messages never hit a regex.
+        :string: the trace line
+        return a (tick, count, thread, level, comp, line, func, msg) tuple"""
+        tick = count = thread = level = comp = line = func = None
+        pos = 0
+        if string.startswith('^', pos):
+            mo = cls.TIMECRE.match(string, pos)
+            tick = mo.group('tick')
+            pos = mo.end()
+        if string.startswith(':', pos):
+            mo = cls.COUNTCRE.match(string, pos)
+            count = mo.group('count')
+            pos = mo.end()
+        if string.startswith('{', pos):
+            mo = cls.THREADCRE.match(string, pos)
+            thread = mo.group('thread')
+            pos = mo.end()
+        if string[pos:pos+1] in LEVELS:
+            mo = cls.LEVELCRE.match(string, pos)
+            level = mo.group('level')
+            pos = mo.end()
+        mo = cls.FUNCCRE.match(string, pos)
+        if mo.end() > pos:
+            comp, line, func = mo.groups()
+            pos = mo.end()
+        return tick, count, thread, level, comp, line, func, \
+            string[pos:].lstrip()
 
     def _print_line(self, indent, tid, level, stime, string):
         """Emit a formatted line"""
@@ -132,8 +200,32 @@ class BaseFormatter:
         """Enable or disable raw (uncolorized) output"""
         pass
 
+    def _write(self, text):
+        """Queue a string for the output stream"""
+        self._outbuf.append(text)
+        self._outlen += len(text)
+
+    def _flush(self, sync=True):
+        """Write out all queued strings at once
+        :sync: whether to also flush the output stream"""
+        if self._outbuf:
+            self._out.write(''.join(self._outbuf))
+            self._outbuf.clear()
+            self._outlen = 0
+        if sync:
+            self._out.flush()
+
+    def _end_line(self):
+        """Complete an output line: it is flushed right away, unless the
+        formatter is buffered, which only writes out FLUSH_SIZE chunks"""
+        if not self._buffered:
+            self._flush()
+        elif self._outlen >= self.FLUSH_SIZE:
+            self._flush(False)
+
     def set_output(self, out):
         """Set the output stream"""
+        self._flush()
         self._out = out
 
     def start(self):
@@ -141,131 +233,153 @@ class BaseFormatter:
 
     def stop(self):
         """Stop (finalize) the formatter job"""
-        pass
+        self._flush()
 
     def inject(self, string, logger=None):
         """Inject a string into the formatter"""
-        # get rid of carriage return chars
-        if not isinstance(string, str):
-            string = string.decode('latin-1').strip('\n\r')
-
-        self._use_raw_mode(True)
-        injected = self._filtermime.inject(string)
-        self._use_raw_mode(False)
-        if injected:
-            return
+        # get rid of carriage return chars; the MIME filter works on bytes,
+        # so that MIME data received as bytes never needs to be decoded
+        if isinstance(string, str):
+            string = string.strip('\n\r')
+            data = string.encode('latin-1', 'replace')
+        else:
+            # bytearray lines are not hashable, which the MIME filter needs
+            data = bytes(string).strip(b'\n\r')
+            string = None
+
+        if self._filtermime.is_candidate(data):
+            self._use_raw_mode(True)
+            # the MIME filter may print out progress on the same stream
+            self._flush(False)
+            injected = self._filtermime.inject(data)
+            self._use_raw_mode(False)
+            if injected:
+                self._end_line()
+                return
+
+        if string is None:
+            string = data.decode('latin-1')
+
+        if string[:1] in PREFIX_CHARS or '^' in string:
+            self._inject_trace(string, logger)
+        else:
+            self._inject_message(string, logger)
+
+    def _inject_message(self, string, logger):
+        """Emit a line that bears no trace prefix, only an optional function
+        location"""
+        mo = self.FUNCCRE.match(string)
+        pos = mo.end()
+        if pos:
+            comp, line, func = mo.groups()
+            string = '%s::%s [%d] %s' % (comp, func, int(line),
+                                         string[pos:].lstrip())
+        else:
+            string = string.lstrip()
+        self._indent = 0
+        self._print_line(0, None, 0, '', ' ' + string)
+        self._end_line()
+        if logger:
+            logger.log(DEBUG, '%s', string, extra={})
 
-        tid = None
+    def _inject_trace(self, string, logger):
+        """Parse and emit a line that may start with a trace prefix"""
         target_time = None
         htime = ''
-        lvlnum = 0
-        lmo = BaseFormatter.LINECRE.match(string)
-        if lmo:
-            tick = lmo.group('tick')
-            if tick is None:
-                # on init, the first trace may be corrupted because of
-                # previous traces in various comm line buffers or invalid
-                # chars sampled on physical line connection, so try to locate
-                # the init string in the received buffer
-                pos = string.rfind('^')
-                if pos >= 0:
-                    trailing = string[pos:]
-                    lmo = BaseFormatter.LINECRE.match(trailing)
-                    tick = lmo.group('tick')
-            if tick:
-                tick = int(tick, 16)
-                if 0 == tick and 'tick:' in string:
-                    self._init_time()
-                    # recover the target tick period to compute the proper
-                    # clock on the host
-                    if string.endswith('us'):
-                        try:
-                            us = float(string.split(' ')[-2])
-                        except ValueError:
-                            raise ValueError("Failed to parse tick period")
-                        self._period = us/1000000.0
-                    elif string.endswith('Hz'):
-                        try:
-                            hz = int(string.split(' ')[-2])
-                        except ValueError:
-                            raise ValueError("Failed to parse tick frequency")
-                        self._period = 1/hz
-                tick_time = self._period*float(tick)
-                target_time = self._start_time+tick_time
-                ms = (1000*target_time) % 1000
-                htime = '%s.%03d' % (strftime('%H:%M:%S',
-                                              localtime(target_time)), ms)
-            count = lmo.group('count') and int(lmo.group('count'), 16)
-            if count is not None:
-                if self._last_count != (256-1) and count == 0:
-                    # reset @ startup
-                    self._print_oob('<restart> %d' % self._last_count)
-                    self._stacks.clear()
-                else:
-                    exp_count = (self._last_count + 1) % 256
-                    if count != exp_count:
-                        self._print_oob('lost %d messages' % (count-exp_count))
-                self._last_count = count
-            tid = lmo.group('thread') and int(lmo.group('thread'))
-            level = lmo.group('level')
-            if level:
-                try:
-                    lvlnum, lvlstr, lvllog = LEVELS[level]
-                except KeyError:
-                    lvlnum, lvlstr, lvllog = LEVELS['F']
-            else:
-                lvlstr = ''
-                lvllog = DEBUG
-            stid = tid
-            if tid is None and level and level in '<>':
-                tid = 0
-            if all(lmo.group('comp', 'func', 'line')):
-                line = lmo.group('line') and int(lmo.group('line'))
-                function = '%s::%s' % lmo.group('comp', 'func')
-                string = '%s [%d] %s' % \
-                    (function, line, lmo.group('msg'))
-            else:
-                string = lmo.group('msg')
-                function = None
-
-            # shifts the text when coming in a method
-            if function and level == '>':
-                self._stackpush(tid, function)
-
-            # calcs the shift to operate for the trace
-            if tid is not None:
-                self._indent = 2*(self._stacksize(tid)-1)
-            else:
-                self._indent = 0
-
-            # shifts back when going out of the method
-            if function and level == '<':
-                # detects stack empty case (returns from a method without
-                # previously entered it)
-                if self._stacksize(tid) < 1:
-                    self._print_stack_error('underflow in thread %d' % tid)
-
-                stored_function = self._stackpop(tid)
-
-                # detects stack mismatch case (returns from a function which
-                # is not the expected one)
-                if function != stored_function:
-                    self._print_stack_error('thread %d' % tid,
-                                            (function, stored_function,
-                                             self._stacktop(tid)))
-                    # now tries to recover from a corrupted stack
-                    # check if the shift is alone
-                    if stored_function == self._stacktop(tid):
-                        # then get the synchro by removing the supplemental
-                        # item in the list
-                        self._stackpop(tid)
+        fields = self._parse_line(string)
+        if fields[0] is None:
+            # on init, the first trace may be corrupted because of
+            # previous traces in various comm line buffers or invalid
+            # chars sampled on physical line connection, so try to locate
+            # the init string in the received buffer
+            pos = string.rfind('^')
+            if pos >= 0:
+                fields = self._parse_line(string[pos:])
+        tick, count, thread, level, comp, line, func, msg = fields
+        if tick:
+            tick = int(tick, 16)
+            if 0 == tick and 'tick:' in string:
+                self._init_time()
+                # recover the target tick period to compute the proper
+                # clock on the host
+                pmo = self.PERIODCRE.search(string)
+                if pmo:
+                    us, hz = pmo.groups()
+                    if us:
+                        self._period = float(us)/1000000.0
                     else:
-                        # then get the synchro by canceling the latest action
-                        self._stackpush(tid, stored_function)
+                        self._period = 1/int(hz)
+                elif string.endswith('us'):
+                    raise ValueError("Failed to parse tick period")
+                elif string.endswith('Hz'):
+                    raise ValueError("Failed to parse tick frequency")
+            tick_time = self._period*float(tick)
+            target_time = self._start_time+tick_time
+            ms = (1000*target_time) % 1000
+            second = int(target_time)
+            if second != self._last_hms[0]:
+                self._last_hms = (second,
+                                  strftime('%H:%M:%S', localtime(second)))
+            htime = '%s.%03d' % (self._last_hms[1], ms)
+        count = count and HEX_BYTES[count]
+        if count is not None:
+            if self._last_count != (256-1) and count == 0:
+                # reset @ startup
+                self._print_oob('<restart> %d' % self._last_count)
+                self._stacks.clear()
+                self._indents.clear()
+            else:
+                exp_count = (self._last_count + 1) % 256
+                if count != exp_count:
+                    self._print_oob('lost %d messages' % (count-exp_count))
+            self._last_count = count
+        tid = thread and int(thread)
+        lvlnum, lvlstr, lvllog = LEVEL_INFO.get(level, LEVEL_DEFAULT)
+        stid = tid
+        if tid is None and level and level in '<>':
+            tid = 0
+        if comp and func and line:
+            function = '%s::%s' % (comp, func)
+            string = '%s [%d] %s' % (function, int(line), msg)
+        else:
+            string = msg
+            function = None
+
+        # shifts the text when coming in a method
+        if function and level == '>':
+            self._stackpush(tid, function)
+
+        # retrieves the shift to operate for the trace
+        self._indent = self._indents.get(tid, 0)
+
+        # shifts back when going out of the method
+        if function and level == '<':
+            # detects stack empty case (returns from a method without
+            # previously entered it)
+            if self._stacksize(tid) < 1:
+                self._print_stack_error('underflow in thread %d' % tid)
+
+            stored_function = self._stackpop(tid)
+
+            # detects stack mismatch case (returns from a function which
+            # is not the expected one)
+            if function != stored_function:
+                self._print_stack_error('thread %d' % tid,
+                                        (function, stored_function,
+                                         self._stacktop(tid)))
+                # now tries to recover from a corrupted stack
+                # check if the shift is alone
+                if stored_function == self._stacktop(tid):
+                    # then get the synchro by removing the supplemental
+                    # item in the list
+                    self._stackpop(tid)
+                else:
+                    # then get the synchro by canceling the latest action
+                    self._stackpush(tid, stored_function)
 
         # print the current line
-        self._print_line(self._indent, stid, lvlnum, htime,
-                         ' '.join((lvlstr, string)))
+        self._print_line(self._indent, stid, lvlnum, htime, lvlstr + string)
+        self._end_line()
         if logger:
             extra = {} if target_time is None else {'timestamp': target_time}
             if stid is not None:
@@ -308,32 +422,40 @@ class TextFormatter(BaseFormatter):
             self._lastid = None
 
     def _print_line(self, indent, tid, level, stime, string):
-        space = indent and (' ' * indent) or ''
+        if 0 <= indent < len(INDENTS):
+            space = INDENTS[indent]
+        else:
+            space = ' ' * indent
         if stime:
             self.update_color(0)
-            print(stime, end=' ', file=self._out)
+            self._write('%s ' % stime)
         self.update_color(tid, level)
-        idstr = tid is not None and '#%02d ' % tid or ''
-        print('%s%s%s' % (idstr, space, string), file=self._out)
-        self._out.flush()
+        idstr = TID_PREFIXES.get(tid)
+        if idstr is None:
+            idstr = '#%02d ' % tid
+        self._write('%s%s%s\n' % (idstr, space, string))
 
     def _print_stack_error(self, string, info=None):
         self.update_color(-1)
-        print('STACK TRACE ERROR: %s' % string, file=self._out)
+        self._write('STACK TRACE ERROR: %s\n' % string)
         if info:
             (func, expect, next_) = info
-            print(' got      %s' % func, file=self._out)
-            print(' expected %s' % expect, file=self._out)
-            print(' next     %s' % next_, file=self._out)
+            self._write(' got      %s\n'
+                        ' expected %s\n'
+                        ' next     %s\n' % (func, expect, next_))
         self.update_color(0)
 
     def _print_oob(self, string):
         self.update_color(-1)
-        print(string, file=self._out)
+        self._write('%s\n' % string)
         self.update_color(0)
 
     def start(self):
         self.update_color(0)
+        self._flush()
+
+    def stop(self):
+        self._flush()
 
     def update_color(self, tid, level=0):
         """Change the output color"""
@@ -341,7 +463,8 @@ class TextFormatter(BaseFormatter):
 
     def show_colors(self):
         """Show supported color, for debug purpose only"""
-        print('Color mode is not supported', file=self._out)
+        self._write('Color mode is not supported\n')
+        self._flush()
 
 
 # --- A N S I   O U T P U T -------------------------------------------------
@@ -358,6 +481,8 @@ class AnsiFormatter(TextFormatter):
     COLOR_RANGE = 7
     BACKGROUND_COLOR = 9
 
+    ESCAPES = {}
+
     def __init__(self, output, *args, **kwargs):
         if get_term_colors() < self.MAX_COLORS:
             raise AssertionError("Not an ANSI terminal")
@@ -375,28 +500,31 @@ class AnsiFormatter(TextFormatter):
         self._reverse = False
         for c in range(0, self.MAX_COLORS):
             self._reset_term()
+            self._flush()
             print("Color %3d " % c, end=' ')
             self._fg = c % (self.COLOR_RANGE+1)
             self._bold = (c//(self.COLOR_RANGE+1)) > 0
             self._set_term_color()
+            self._flush()
             print("Message")
         self._reset_term()
+        self._flush()
 
     def stop(self):
         self._reset_term()
+        self._flush()
 
     def update_color(self, tid, level=0):
         """Update the terminal color parameters to highlight each thread with
         a different color"""
         oldid = self._curcode
         if tid and tid > 0:
-            if tid not in self._threads:
+            code = self._threads.get(tid)
+            if code is None:
                 # threads may share color if there are too many of them.
-                key = 1+(len(list(self._threads.keys())) %
-                         (2*(self.COLOR_RANGE)))
-                self._threads[tid] = (key > self.COLOR_RANGE) and (key+1) \
-                    or key
-            code = self._threads[tid]
+                key = 1+(len(self._threads) % (2*(self.COLOR_RANGE)))
+                code = (key > self.COLOR_RANGE) and (key+1) or key
+                self._threads[tid] = code
         else:
             code = level
         if code != self._curcode:
@@ -421,13 +549,18 @@ class AnsiFormatter(TextFormatter):
 
     def _set_term_color(self):
         """Emit the ANSI escape string to change the current color"""
-        self._out.write('%s%02d;%02d;%02d;%02d%s' %
-                       (self.CSI,
-                        self._bold and 1 or 22,
-                        self._reverse and 7 or 27,
-                        30 + self._fg,
-                        40 + self._bg,
-                        self.END))
+        key = (self._bold, self._reverse, self._fg, self._bg)
+        esc_cmd = self.ESCAPES.get(key)
+        if esc_cmd is None:
+            esc_cmd = '%s%02d;%02d;%02d;%02d%s' % \
+                (self.CSI,
+                 self._bold and 1 or 22,
+                 self._reverse and 7 or 27,
+                 30 + self._fg,
+                 40 + self._bg,
+                 self.END)
+            self.ESCAPES[key] = esc_cmd
+        self._write(esc_cmd)
 
     def _reset_term(self):
         """Reset the terminal to its initial state"""
@@ -450,11 +583,14 @@ class ExtendedAnsiFormatter(TextFormatter):
                               40 + AnsiFormatter.BACKGROUND_COLOR,
                               AnsiFormatter.END)
 
+    ESCAPES = {}
+    PALETTES = {}
+
     def __init__(self, output, *args, **kwargs):
         if output.name == '<stdout>' and get_term_colors() < 256:
             raise AssertionError("Terminal does not support 256 color mode")
         TextFormatter.__init__(self, output, *args, **kwargs)
-        self._init_colors()
+        self._colors = self._load_colors()
         self._threads = {}
         self._curcode = None
         self._fg = 0
@@ -462,24 +598,32 @@ class ExtendedAnsiFormatter(TextFormatter):
         self._reverse = False
         self._reset_term()
 
-    def _init_colors(self):
-        self._colors = [7]
+    @classmethod
+    def _load_colors(cls):
+        """Load the color palette from the user or default configuration
+        file. Files are only parsed once per formatter class."""
+        colors = cls.PALETTES.get(cls)
+        if colors is not None:
+            return colors
+        colors = (7, )
         color_files = [joinpath(getenv('HOME'), '.pylogtermrc'),
                        joinpath(Resources.get_etc(), 'tools', 'pylogterm.rc')]
         for color_file in color_files:
             if isfile(color_file):
                 cfg = ConfigParser()
                 with open(color_file) as cfp:
-                    cfg.readfp(cfp)
-                section = self.__class__.__name__[:-9].lower()
+                    cfg.read_file(cfp)
+                section = cls.__name__[:-9].lower()
                 if cfg.has_option(section, 'colors'):
                     colorstr = cfg.get(section, 'colors')
                     try:
-                        colors = [int(c.strip()) for c in colorstr.split(',')]
-                        self._colors = colors
+                        colors = tuple(int(c.strip())
+                                       for c in colorstr.split(','))
                     except Exception as ex:
-                        print('Invalid color definition: %s', str(ex))
+                        print('Invalid color definition: %s' % ex)
                 break
+        cls.PALETTES[cls] = colors
+        return colors
 
     @staticmethod
     def lfsr_7(lfsr):
@@ -489,16 +633,19 @@ class ExtendedAnsiFormatter(TextFormatter):
 
     def _set_term_color(self):
         """Emit the ANSI escape string to change the current color"""
-        rev = self.RV_FORMAT % (self._reverse and 7 or 27)
-        fg = self.FG_FORMAT % self._fg
-        if self._bg == AnsiFormatter.BACKGROUND_COLOR:
-            bg = self.DF_FORMAT
-        else:
-            bg = self.BG_FORMAT % self._bg
-        # print("TC %s %s %s" % (self._reverse, self._fg, self._bg))
-        esc_cmd = ''.join((rev, fg, bg))
+        key = (self._reverse, self._fg, self._bg)
+        esc_cmd = self.ESCAPES.get(key)
+        if esc_cmd is None:
+            rev = self.RV_FORMAT % (self._reverse and 7 or 27)
+            fg = self.FG_FORMAT % self._fg
+            if self._bg == AnsiFormatter.BACKGROUND_COLOR:
+                bg = self.DF_FORMAT
+            else:
+                bg = self.BG_FORMAT % self._bg
+            esc_cmd = ''.join((rev, fg, bg))
+            self.ESCAPES[key] = esc_cmd
         # print("ESC:", esc_cmd.replace('\x1b', '^'))
-        self._out.write(esc_cmd)
+        self._write(esc_cmd)
 
     def _reset_term(self):
         """Reset the terminal to its initial state"""
@@ -514,11 +661,11 @@ class ExtendedAnsiFormatter(TextFormatter):
         oldid = self._curcode
         if tid or level == 0:
             if tid is not None and tid >= 0:
-                if tid not in self._threads:
+                code = self._threads.get(tid)
+                if code is None:
                     # threads may share color if there are too many of them.
-                    key = len(self._threads) % len(self._colors)
-                    self._threads[tid] = self._colors[key % len(self._colors)]
-                code = self._threads[tid]
+                    code = self._colors[len(self._threads) % len(self._colors)]
+                    self._threads[tid] = code
             else:
                 code = tid
         else:
@@ -545,10 +692,13 @@ class ExtendedAnsiFormatter(TextFormatter):
         for c in range(len(self._colors)):
             self._reset_term()
             self._fg = self._colors[c]
+            self._flush()
             print("Color %3d " % self._fg, end=' ')
             self._set_term_color()
+            self._flush()
             print("Message")
         self._reset_term()
+        self._flush()
 
 
 # --- X H T M L   O U T P U T -----------------------------------------------
@@ -557,6 +707,7 @@ class XhtmlFormatter(BaseFormatter):
     """Formatter that output XHTML-compliant stream"""
     COLORS = ['black', 'red', 'green', '#e0a030', 'blue', 'magenta', 'cyan',
               '#211']
+    ESCAPE_MAP = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
 
     def __init__(self, output, *args, **kwargs):
         BaseFormatter.__init__(self, output, *args, **kwargs)
@@ -564,27 +715,27 @@ class XhtmlFormatter(BaseFormatter):
 
     def start(self):
         self._print_header()
+        self._flush()
 
     def stop(self):
         self._print_footer()
+        self._flush()
 
-    @staticmethod
-    def escape(s):
+    @classmethod
+    def escape(cls, s):
         """Escape special XHTML characters"""
-        return s.replace('&',
-                         '&amp;').replace('<',
-                                          '&lt;').replace('>', '&gt;')
+        return s.translate(cls.ESCAPE_MAP)
 
     def _print_line(self, indent, tid, level, stime, string):
         """Print out a single line, using XHTML markup
         :string: the string to print out"""
-        print('<tr>', end=' ', file=self._out)
+        self._write('<tr> ')
         if stime:
-            print('<th class="time">%s</th>' % stime, end=' ', file=self._out)
+            self._write('<th class="time">%s</th> ' % stime)
         space = indent and ('&nbsp;' * indent) or ''
         if tid and tid > 0 and tid not in self._threads:
             # threads may share color if there are too many of them.
-            self._threads[tid] = (1 + len(list(self._threads.keys()))) % \
+            self._threads[tid] = (1 + len(self._threads)) % \
                                     (len(self.COLORS)-1)
         fg = ''
         bg = None
@@ -592,46 +743,45 @@ class XhtmlFormatter(BaseFormatter):
             fg = self.COLORS[-1]
         elif tid < 0:
             fg = bg
-            bg = self.COLORS[-id]
+            bg = self.COLORS[-tid]
         elif tid == 0:
             fg = self.COLORS[-1]
         else:
             fg = self.COLORS[self._threads[tid]]
-        string = '%s%s' % (space, self.escape(string))
-        print('<td><span style="color: %s;' % fg, end=' ', file=self._out)
+        self._write('<td><span style="color: %s; ' % fg)
         if bg:
-            print('background-color: %s' % bg, end=' ', file=self._out)
-        print('">%s</span></td></tr>' % string, file=self._out)
+            self._write('background-color: %s ' % bg)
+        self._write('">%s%s</span></td></tr>\n' % (space, self.escape(string)))
 
     def _print_stack_error(self, string, info=None):
         s = self.escape(string)
-        print('''</table>
+        self._write('''</table>
            <div class="error">
-           <ul><li>Stack trace Error: %s</li></ul>''' % s, file=self._out)
+           <ul><li>Stack trace Error: %s</li></ul>\n''' % s)
 
         if info:
-            print('''<div class="stack">
+            self._write('''<div class="stack">
                <table>
                  <tr><th>received</th><td>%s</td></tr>
                  <tr><th>expected</th><td>%s</td></tr>
-                 <tr><th>next</th><td>%d</td></tr>
+                 <tr><th>next</th><td>%s</td></tr>
                </table>
-             </div>''' % info, file=self._out)
+             </div>\n''' % info)
 
-        print('''</div>
-            <table class="code">''', file=self._out)
+        self._write('''</div>
+            <table class="code">\n''')
 
     def _print_oob(self, string):
         s = self.escape(string)
-        print('''</table>
+        self._write('''</table>
            <div class="oob">
-           <ul><li>%s</li></ul>''' % s, file=self._out)
-        print('''</div>
-            <table class="code">''', file=self._out)
+           <ul><li>%s</li></ul>\n''' % s)
+        self._write('''</div>
+            <table class="code">\n''')
 
     def _print_header(self):
         """Generate a XHTML 1.0 header"""
-        print(r"""
+        self._write(r"""
         <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"
          "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
         <html xmlns="http://www.w3.org/1999/xhtml">
@@ -683,13 +833,28 @@ class XhtmlFormatter(BaseFormatter):
          <body>
           <div>
            <table class="code">
-        """, file=self._out)
+        """)
+        self._write('\n')
 
     def _print_footer(self):
         """Generate a XHTML 1.0 footer"""
-        print(r"""
+        self._write(r"""
            </table>
           </div>
          </body>
         </html>
-        """, file=self._out)
+        """)
+        self._write('\n')
+
+
+if __name__ == '__main__':
+    def unittest():
+        """Simple unit test: format a log stream from stdin, fed as bytearray
+           lines as the serial console does"""
+        import sys
+        formatter = TextFormatter(sys.stdout)
+        formatter.start()
+        for line in sys.stdin.buffer:
+            formatter.inject(bytearray(line))
+        formatter.stop()
+    unittest()
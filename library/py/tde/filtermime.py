@@ -18,13 +18,27 @@ destination file.
 
 import base64
 import binascii
+import hashlib
 import os
 import re
 import time
 import sys
+import zlib
+try:
+    # SIMD-accelerated decoder, with the same API as the standard one
+    from pybase64 import b64decode
+except ImportError:
+    from base64 import b64decode
 
 __all__ = ['FilterMime']
 
+# Various RE to parse input stream
+CTE_RE = rb'^Content-Transfer-Encoding: (.*)'
+CTY_RE = rb'^Content-Type:\s([\w\d\-]+\/[\w\d\-]+)(;\s)?(?:name=(.*))$'
+CTL_RE = rb'^Content-Length:\s(\d+)$'
+CTD_RE = rb'^Content-SHA1:\s([A-Za-z0-9\+\/]+={0,2})$'
+CTC_RE = rb'^Content-coding:\sdeflate$'
+
 # Hints for PyLint:
 #   catch Exception, too few public methods
 #pylint: disable-msg=W0703
@@ -37,113 +51,109 @@ class FilterMime:
     """
     (MIME_IDLE, MIME_HEADER, MIME_DATA) = range(3)
 
+    CTECRE = re.compile(CTE_RE, re.IGNORECASE)
+    CTYCRE = re.compile(CTY_RE, re.IGNORECASE)
+    CTLCRE = re.compile(CTL_RE, re.IGNORECASE)
+    CTDCRE = re.compile(CTD_RE, re.IGNORECASE)
+    CTCCRE = re.compile(CTC_RE, re.IGNORECASE)
+
+    DECODE_CHUNK = 64 << 10
+    """Amount of base64 data to collect before decoding it"""
+
+    B64_ALPHABET = (b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                    b'abcdefghijklmnopqrstuvwxyz0123456789+/=')
+    """Valid characters of a base64 data line"""
+
+    INFLATE_CHUNK = 1 << 20
+    """Maximum amount of inflated data to produce at once"""
+
+    PROGRESS_PERIOD = 100 * 1000 * 1000
+    """Minimum delay in nanoseconds between two progress updates"""
+
     def __init__(self, outdir=None, verbose=True):
         # MIME transfer marker: 0: no MIME, 1: MIME header, 2: MIME data
         self._state = self.MIME_IDLE
-        # MIME file
-        self._file = None
+        # MIME file descriptor
+        self._fd = None
         # Expected file length
         self._length = 0
         # Received bytes
         self._count = 0
-        # Start time
-        self._start = False
+        # Start time, last progress update time
+        self._start = 0
+        self._last_progress = 0
         # MD checksum for data transfer
         self._checksum = None
         # Message Digest object
         self._md = None
         # ZLIB compression
         self._zstream = None
+        # Pending base64 lines, and their overall length
+        self._b64buf = []
+        self._b64len = 0
         # Output path for received files
         self._outdir = outdir or os.curdir
+        self._outdir_ready = False
         # Whether to display Download progress or not
         self._verbose = verbose
-        # Various RE to parse input stream
-        ctere = r'^Content-Transfer-Encoding: (.*)'
-        self.ctecre = re.compile(ctere, re.IGNORECASE)
-        ctyre = r'^Content-Type:\s([\w\d\-]+\/[\w\d\-]+)(;\s)?(?:name=(.*))$'
-        self.ctycre = re.compile(ctyre, re.IGNORECASE)
-        ctlre = r'^Content-Length:\s(\d+)$'
-        self.ctlcre = re.compile(ctlre, re.IGNORECASE)
-        ctdre = r'^Content-SHA1:\s([A-Za-z0-9\+\/]+={0,2})$'
-        self.ctdcre = re.compile(ctdre, re.IGNORECASE)
-        ctcre = r'^Content-coding:\sdeflate$'
-        self.ctccre = re.compile(ctcre, re.IGNORECASE)
-        mimre = r'^[A-Za-z0-9\+\/=]+$'
-        self.mimcre = re.compile(mimre)
-
-    def inject(self, string):
-        """Inject a string into the formatter"""
-        ctemo = self.ctecre.match(string)
-        if ctemo:
-            if ctemo.group(1).strip().lower() != 'base64':
-                print('MIME encoding "%s" not supported' %
-                      ctemo.group(1), file=sys.stderr)
-                self._reset()
-                return False
-            return True
-
-        # Retrieves the name of the file, and open a file for writing
-        ctymo = self.ctycre.match(string)
-        if ctymo:
-            mimefile = ctymo.group(3)
-            if not os.path.isdir(self._outdir):
-                try:
-                    os.makedirs(self._outdir)
-                except Exception:
-                    print("Unable to create host dir %s, falling back to %s"
-                          % (self._outdir, os.curdir), file=sys.stderr)
-                    self._outdir = os.curdir
-            if '/' in mimefile:
-                mimedir = os.path.dirname(mimefile)
-                destdir = os.path.join(self._outdir, mimedir)
-                if not os.path.isdir(destdir):
-                    try:
-                        os.makedirs(destdir)
-                    except Exception:
-                        print("Unable to create output dir %s, "
-                              "falling back to %s"
-                              % (destdir, self._outdir), file=sys.stderr)
-                        destdir = self._outdir
-            mimefile = os.path.join(self._outdir, mimefile)
-            self._file = open(mimefile, "wb")
-            if self._file:
-                self._state = self.MIME_HEADER
-                self._count = 0
-                self._start = time.time()
-                if self._verbose:
-                    print('[Saving file as %s]' % mimefile)
-            return True
+        # Header handlers, keyed on lower case header name
+        self._headers = {
+            b'content-transfer-encoding': self._parse_encoding,
+            b'content-type': self._parse_type,
+            b'content-length': self._parse_length,
+            b'content-sha1': self._parse_checksum,
+            b'content-coding': self._parse_coding}
 
-        # Retrieves the length of the file
-        ctlmo = self.ctlcre.match(string)
-        if ctlmo:
-            self._length = int(ctlmo.group(1))
-            return True
+    def is_candidate(self, line):
+        """Tell whether a line may be consumed by the filter, i.e. whether
+        it is a MIME header or a MIME transfer is in progress"""
+        return self._state != self.MIME_IDLE or \
+            line[:8].lower() == b'content-'
 
-        # Hash checksum is always encoded with Base64, see RFC1864
-        # do not decode it, as local checksum can generate a
-        # Base64-encoded checksum, without the padding byte(s)
-        ctdmo = self.ctdcre.match(string)
-        if ctdmo:
-            import hashlib
-            self._md = hashlib.sha1()
-            self._checksum = ctdmo.group(1)
+    def inject(self, line):
+        """Inject a line, as bytes without line ending, into the filter"""
+        # fast path for MIME data, i.e. a non-empty line only made of base64
+        # characters, which cannot be mistaken for a header or a marker
+        if self._state == self.MIME_DATA and line and \
+                not line.translate(None, self.B64_ALPHABET):
+            size = len(line)
+            pad = line.find(b'=')
+            if size & 3 or (pad >= 0 and line[pad:] not in (b'=', b'==')):
+                # a truncated or corrupted line would make the whole pending
+                # chunk undecodable: only drop this one
+                print("\nERROR in MIME transfer: invalid base64 line [%s]" %
+                      line.decode('latin-1'))
+                return True
+            self._b64buf.append(line)
+            self._b64len += size
+            # padding may only appear at the end of a base64 stream
+            if self._b64len >= self.DECODE_CHUNK or pad >= 0:
+                self._decode()
+            self._count += size+2 # CR/LF filtered out
+            if self._verbose:
+                tc = time.monotonic_ns()
+                if tc-self._last_progress >= self.PROGRESS_PERIOD:
+                    self._show_progress(tc)
             return True
 
-        # Data transfer is compressed using the ZLIB library
-        ctdmo = self.ctccre.match(string)
-        if ctdmo:
-            import zlib
-            self._zstream = zlib.decompressobj()
-            return True
+        name, sep, _ = line.partition(b':')
+        if sep:
+            handler = self._headers.get(name.lower())
+            if handler:
+                if self._state == self.MIME_DATA:
+                    # a new header block interrupts the current transfer:
+                    # complete the previous file before any header applies
+                    self._reset()
+                handled = handler(line)
+                if handled is not None:
+                    return handled
 
         # no MIME transfer detected
         if not self._state:
             return False
 
         # start/stop condition (empty line)
-        if not string.strip():
+        if not line.strip():
             # first occurence: start condition
             if self._state == self.MIME_HEADER:
                 self._state = self.MIME_DATA
@@ -151,12 +161,13 @@ class FilterMime:
             # second occurence: stop condition
             elif self._state == self.MIME_DATA:
                 if self._verbose:
+                    self._show_progress(time.monotonic_ns())
                     print('')
+                self._decode()
                 # padding+line endings tolerance
                 if abs(self._length - self._count) > 2:
                     print('Warning: %d/%d bytes received' %
                           (self._length, self._count))
-                self._file.close()
                 # now verify the received data
                 if self._md:
                     # compare b64 encoded strings
@@ -183,71 +194,192 @@ class FilterMime:
         if self._state != self.MIME_DATA:
             return False
 
-        # MIME data
-        mimmo = self.mimcre.match(string)
-        if mimmo:
-            data = base64.b64decode(string)
-            self._md and self._md.update(data)
-            if self._zstream:
-                try:
-                    zoutput = self._zstream.decompress(data)
-                    self._file.write(zoutput)
-                except Exception:
-                    print("Unable to inflate ZLIB stream, storing raw data",
-                          file=sys.stderr)
-                    if self._md:
-                        print(" SHA-1 digest won't match", file=sys.stderr)
-                    # be conservative: disable Zlib inflation and keep data
-                    # without any alteration
-                    self._zstream = None
-                    self._file.write(data)
-            else:
-                self._file.write(data)
-            self._count += len(string)+2 # CR/LF filtered out
-            if self._length:
-                if self._count < self._length:
-                    tc = time.time()
-                    elap = tc-self._start
-                    tt = (elap*self._length)//self._count
-                    eta = self._start+tt-tc
-                    if eta < 0:
-                        eta = 0
-                    etam = int(eta//60)
-                    etas = eta-(etam*60)
-                else:
-                    etam = etas = 0
-                if self._verbose:
-                    print("\rRX: %02.1f%% ETA %02d'%02d\"" %
-                        ((min(100.0,(100*self._count)//self._length)),
-                        etam, etas), end=' ')
-            else:
-                if self._verbose:
-                    print("\rRX: %u bytes" % self._count)
-            sys.stdout.flush()
-            return True
-        else:
-            print("\nERROR in MIME transfer: [%s]" % string)
+        # anything else than base64 data
+        print("\nERROR in MIME transfer: [%s]" % line.decode('latin-1'))
+        self._reset()
+        return False
+
+    def _parse_encoding(self, line):
+        """Check the transfer encoding"""
+        ctemo = self.CTECRE.match(line)
+        if not ctemo:
+            return None
+        encoding = ctemo.group(1).decode('latin-1')
+        if encoding.strip().lower() != 'base64':
+            print('MIME encoding "%s" not supported' %
+                  encoding, file=sys.stderr)
             self._reset()
             return False
+        return True
+
+    def _parse_type(self, line):
+        """Retrieve the name of the file, and open a file for writing"""
+        ctymo = self.CTYCRE.match(line)
+        if not ctymo:
+            return None
+        mimefile = ctymo.group(3).decode('latin-1')
+        if not self._outdir_ready:
+            try:
+                os.makedirs(self._outdir, exist_ok=True)
+            except Exception:
+                print("Unable to create host dir %s, falling back to %s"
+                      % (self._outdir, os.curdir), file=sys.stderr)
+                self._outdir = os.curdir
+            self._outdir_ready = True
+        if '/' in mimefile:
+            mimedir = os.path.dirname(mimefile)
+            destdir = os.path.join(self._outdir, mimedir)
+            try:
+                os.makedirs(destdir, exist_ok=True)
+            except Exception:
+                print("Unable to create output dir %s, "
+                      "falling back to %s"
+                      % (destdir, self._outdir), file=sys.stderr)
+                destdir = self._outdir
+        mimefile = os.path.join(self._outdir, mimefile)
+        if self._fd is not None:
+            # repeated header, no data has been received yet
+            os.close(self._fd)
+        # unbuffered output: data is only written in large chunks
+        self._fd = os.open(mimefile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                           getattr(os, 'O_BINARY', 0), 0o666)
+        self._state = self.MIME_HEADER
+        self._count = 0
+        self._start = time.monotonic_ns()
+        self._last_progress = 0
+        if self._verbose:
+            print('[Saving file as %s]' % mimefile)
+        return True
+
+    def _parse_length(self, line):
+        """Retrieve the length of the file"""
+        ctlmo = self.CTLCRE.match(line)
+        if not ctlmo:
+            return None
+        self._length = int(ctlmo.group(1))
+        return True
+
+    def _parse_checksum(self, line):
+        """Retrieve the data checksum"""
+        # Hash checksum is always encoded with Base64, see RFC1864
+        # do not decode it, as local checksum can generate a
+        # Base64-encoded checksum, without the padding byte(s)
+        ctdmo = self.CTDCRE.match(line)
+        if not ctdmo:
+            return None
+        self._md = hashlib.sha1()
+        self._checksum = ctdmo.group(1)
+        return True
+
+    def _parse_coding(self, line):
+        """Detect a data transfer compressed using the ZLIB library"""
+        ctcmo = self.CTCCRE.match(line)
+        if not ctcmo:
+            return None
+        self._zstream = zlib.decompressobj()
+        return True
+
+    def _show_progress(self, tc):
+        """Show the transfer progression and its ETA"""
+        self._last_progress = tc
+        count = self._count
+        length = self._length
+        if length:
+            if not count:
+                # nothing received yet, no estimate
+                eta = 0
+                ratio = 0
+            elif count < length:
+                # remaining time, in seconds
+                eta = (length-count)*(tc-self._start)//count//1000000000
+                ratio = 100*count//length
+            else:
+                eta = 0
+                ratio = 100
+            etam, etas = divmod(eta, 60)
+            progress = "\rRX: %d.0%% ETA %02d'%02d\" " % (ratio, etam, etas)
+        else:
+            progress = "\rRX: %u bytes " % count
+        sys.stdout.write(progress)
+        sys.stdout.flush()
+
+    def _decode(self):
+        """Decode the pending base64 lines and store the resulting data"""
+        if not self._b64buf:
+            return
+        lines = self._b64buf
+        self._b64buf = []
+        self._b64len = 0
+        try:
+            data = b64decode(b''.join(lines))
+        except binascii.Error:
+            # lines are checked on reception, but never lose a whole chunk
+            # on a line that slipped through: only drop the faulty ones
+            data = b''.join(self._decode_lines(lines))
+        self._md and self._md.update(data)
+        if self._zstream:
+            try:
+                zstream = self._zstream
+                zoutput = zstream.decompress(data, self.INFLATE_CHUNK)
+                self._write(zoutput)
+                # a full output chunk may leave pending input or output
+                while zstream.unconsumed_tail or \
+                        len(zoutput) == self.INFLATE_CHUNK:
+                    zoutput = zstream.decompress(zstream.unconsumed_tail,
+                                                 self.INFLATE_CHUNK)
+                    self._write(zoutput)
+            except Exception:
+                print("Unable to inflate ZLIB stream, storing raw data",
+                      file=sys.stderr)
+                if self._md:
+                    print(" SHA-1 digest won't match", file=sys.stderr)
+                # be conservative: disable Zlib inflation and keep data
+                # without any alteration
+                self._zstream = None
+                self._write(data)
+        else:
+            self._write(data)
+
+    @staticmethod
+    def _decode_lines(lines):
+        """Decode base64 lines one by one, skipping the invalid ones"""
+        for line in lines:
+            try:
+                yield b64decode(line)
+            except binascii.Error as exc:
+                print("\nERROR in MIME transfer: %s [%s]" %
+                      (exc, line.decode('latin-1')))
+
+    def _write(self, data):
+        """Write data to the output file"""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
 
     def _reset(self):
         """Reset the current state of the filter"""
-        if self._file:
-            self._file.close()
-            self._file = None
-        self._state = self.MIME_IDLE
-        self._length = 0
-        self._md = None
-        self._zstream = None
+        try:
+            if self._fd is not None:
+                self._decode()
+        finally:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._b64buf.clear()
+            self._b64len = 0
+            self._state = self.MIME_IDLE
+            self._length = 0
+            self._md = None
+            self._zstream = None
 
 if __name__ == '__main__':
     def unittest():
         """Simple unit test"""
         print("Processing Base64 stream from stdin...")
         filtermime = FilterMime()
-        for line in sys.stdin.readlines():
-            line = line.strip('\r\n')
+        for line in sys.stdin.buffer:
+            line = line.strip(b'\r\n')
             r = filtermime.inject(line)
             if not r:
-                print("Unmanaged: [%s]" % line)
+                print("Unmanaged: [%s]" % line.decode('latin-1'))
     unittest()
@@ -44,9 +44,13 @@ class BareStreamToLogger:
         """Write data to the logger, and optionally to the tee stream.
         """
         if self._tee_stream:
-            print(buf, file=self._tee_stream, end='')
+            self._tee_stream.write(buf)
+        log, level = self.log, self._level
+        # do not split the buffer if it is to be discarded anyway
+        if not log.isEnabledFor(level):
+            return
         for line in buf.rstrip().splitlines():
-            self.log.log(self._level, line.rstrip())
+            log.log(level, line.rstrip())
 
     def flush(self):
         if self._tee_stream:
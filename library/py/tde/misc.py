@@ -8,11 +8,12 @@ import logging
 from array import array
 from configparser import SafeConfigParser, InterpolationSyntaxError
 from copy import deepcopy
-from functools import wraps
+from functools import lru_cache
+from itertools import chain
 from logging.handlers import SysLogHandler, SYSLOG_UDP_PORT
 from os import makedirs, unlink
 from os.path import basename, dirname, isdir
-from re import match
+from re import compile as re_compile
 from shutil import move
 from socket import gethostbyname
 from tempfile import NamedTemporaryFile
@@ -30,9 +31,51 @@ FALSE_BOOLEANS = ['off', 'low', 'false', 'disable', 'disabled', 'no', '0']
 
 ASCIIFILTER = ''.join([((len(repr(chr(_x))) == 3) or (_x == 0x5c)) and chr(_x)
                        or '.' for _x in range(128)]) + '.' * 128
-ASCIIFILTER = bytearray(ASCIIFILTER.encode('ascii'))
+ASCIIFILTER = ASCIIFILTER.encode('ascii')
 """ASCII or '.' filter"""
 
+HEXBYTES = tuple('%02x' % _x for _x in range(256))
+"""Hexadecimal representation of each byte value"""
+
+_TRUE_BOOLEANS = frozenset(TRUE_BOOLEANS)
+_FALSE_BOOLEANS = frozenset(FALSE_BOOLEANS)
+
+_MISSING = object()
+
+_IMMUTABLE_TYPES = frozenset((int, float, complex, bool, str, bytes,
+                              type(None)))
+
+_INT_CRE = re_compile(r'^\s*(\d+)\s*(?:([KMkm]i?)?B?)?\s*$')
+_INT_MULTIPLIERS = {'K': (1000),
+                    'KI': (1 << 10),
+                    'M': (1000 * 1000),
+                    'MI': (1 << 20)}
+_SYSLOG_CRE = re_compile(r'^syslog://(?P<host>[^:]*)?(?::(?P<port>\d+))?'
+                         r'(?:/(?P<facility>\w+))?$')
+
+
+def _as_bytearray(data) -> bytearray:
+    """Convert a binary buffer into a bytearray, without copying it if it
+       already is one.
+
+       :param data: binary buffer to convert
+       :type data: bytes or array or bytearray or list(int) or list(bytes)
+       :return: the buffer as a bytearray
+       :raise TypeError: if the buffer type is not supported
+    """
+    if isinstance(data, bytearray):
+        return data
+    if isinstance(data, (bytes, array)):
+        return bytearray(data)
+    try:
+        # data may be a list/tuple, of integers or of buffers
+        items = data if isinstance(data, (list, tuple)) else tuple(data)
+        if items and isinstance(items[0], int):
+            return bytearray(items)
+        return bytearray(b''.join(items))
+    except Exception:
+        raise TypeError("Unsupported data type '%s'" % type(data))
+
 
 def hexdump(data, full=False, abbreviate=False):
     """Convert a binary buffer into a hexadecimal representation.
@@ -45,41 +88,32 @@ def hexdump(data, full=False, abbreviate=False):
        :param bool full: use `hexdump -Cv` format
        :param bool abbreviate: replace identical lines with '*'
     """
-    try:
-        if isinstance(data, (bytes, array)):
-            src = bytearray(data)
-        elif not isinstance(data, bytearray):
-            # data may be a list/tuple
-            src = bytearray(b''.join(data))
-        else:
-            src = data
-    except Exception:
-        raise TypeError("Unsupported data type '%s'" % type(data))
+    src = _as_bytearray(data)
 
     length = 16
+    half = (length//2)*3
+    if full:
+        rowfmt = '%%08x  %%-%ds %%-%ds |%%s|\n' % (half, half)
+    else:
+        rowfmt = '%%06x   %%-%ds  %%s\n' % (length*3)
     result = []
-    last = b''
+    last = None
     abv = False
     for i in range(0, len(src), length):
+        # compare in place, so that repeated rows are never copied
+        if abbreviate and last and src.startswith(last, i):
+            if not abv:
+                result.append('*\n')
+                abv = True
+            continue
+        abv = False
         s = src[i:i+length]
-        if abbreviate:
-            if s == last:
-                if not abv:
-                    result.append('*\n')
-                    abv = True
-                continue
-            else:
-                abv = False
-        hexa = ' '.join(["%02x" % x for x in s])
-        printable = s.translate(ASCIIFILTER).decode('ascii')
+        hexa = s.hex(' ')
+        printable = s.translate(ASCIIFILTER).decode('latin-1')
         if full:
-            hx1, hx2 = hexa[:3*8], hexa[3*8:]
-            hl = length//2
-            result.append("%08x  %-*s %-*s |%s|\n" %
-                          (i, hl*3, hx1, hl*3, hx2, printable))
+            result.append(rowfmt % (i, hexa[:half], hexa[half:], printable))
         else:
-            result.append("%06x   %-*s  %s\n" %
-                          (i, length*3, hexa, printable))
+            result.append(rowfmt % (i, hexa, printable))
         last = s
     return ''.join(result)
 
@@ -93,20 +127,14 @@ def hexline(data, sep=' '):
        :param data: binary buffer to dump
        :type data: bytes or array or bytearray or list(int)
     """
-    try:
-        if isinstance(data, (bytes, array)):
-            src = bytearray(data)
-        elif not isinstance(data, bytearray):
-            # data may be a list/tuple
-            src = bytearray(b''.join(data))
-        else:
-            src = data
-    except Exception:
-        raise TypeError("Unsupported data type '%s'" % type(data))
+    src = _as_bytearray(data)
 
-    hexa = sep.join(["%02x" % x for x in src])
-    printable = src.translate(ASCIIFILTER).decode('ascii')
-    return "(%d) %s : %s" % (len(data), hexa, printable)
+    if len(sep) == 1 and sep.isascii():
+        hexa = src.hex(sep)
+    else:
+        hexa = sep.join([HEXBYTES[x] for x in src])
+    printable = src.translate(ASCIIFILTER).decode('latin-1')
+    return "(%d) %s : %s" % (len(src), hexa, printable)
 
 
 def to_int(value):
@@ -128,17 +156,20 @@ def to_int(value):
         return 0
     if isinstance(value, int):
         return value
-    mo = match(r'^\s*(\d+)\s*(?:([KMkm]i?)?B?)?\s*$', value)
+    if isinstance(value, str):
+        # fast paths for plain decimal and hexadecimal values
+        if value.startswith('0x'):
+            return int(value.strip(), 16)
+        svalue = value.strip()
+        if svalue.isdecimal():
+            return int(svalue)
+    mo = _INT_CRE.match(value)
     if mo:
-        mult = {'K': (1000),
-                'KI': (1 << 10),
-                'M': (1000 * 1000),
-                'MI': (1 << 20)}
         value = int(mo.group(1))
         if mo.group(2):
-            value *= mult[mo.group(2).upper()]
+            value *= _INT_MULTIPLIERS[mo.group(2).upper()]
         return value
-    return int(value.strip(), value.startswith('0x') and 16 or 10)
+    return int(value.strip())
 
 
 def to_bool(value, permissive=True, prohibit_int=False):
@@ -167,9 +198,10 @@ def to_bool(value, permissive=True, prohibit_int=False):
             if value in (0, 1):
                 return bool(value)
         raise ValueError("Invalid boolean value: '%d'", value)
-    if value.lower() in TRUE_BOOLEANS:
+    lvalue = value.lower()
+    if lvalue in _TRUE_BOOLEANS:
         return True
-    if permissive or (value.lower() in FALSE_BOOLEANS):
+    if permissive or (lvalue in _FALSE_BOOLEANS):
         return False
     raise ValueError('"Invalid boolean value: "%s"' % value)
 
@@ -182,7 +214,7 @@ def xor(_a_, _b_):
        :return: xor-ed value
        :rtype: bool
     """
-    return bool((not(_a_) and _b_) or (_a_ and not(_b_)))
+    return (not _a_) != (not _b_)
 
 
 def is_iterable(obj):
@@ -239,28 +271,35 @@ def pretty_period(value: Union[int, float],
        :param units: optional units. Default to 'h m s'. Accept either "degree"
                      to select quote-based notation, or a free string which
                      should be at least 3 char long.
+       :param sep: optional separator between units, default to a space
        :return: the formatted string
     """
-    second = int(value)
-    ms = 0 if isinstance(value, int) else int(1000*(value-second+0.0005))
-    hour = second//3600
-    second -= hour*3600
-    minute = second//60
-    second -= minute*60
+    if isinstance(value, int):
+        second, ms = value, 0
+    else:
+        second, ms = divmod(int(1000*value+0.5), 1000)
+    minute, second = divmod(second, 60)
+    hour, minute = divmod(minute, 60)
     if not units:
         units = 'smh'
-    elif fmt == 'degree':
+    elif units == 'degree':
         units = '"\'h'
     else:
         if not isinstance(units, str) or len(units) < 3:
             raise ValueError('Invalid format')
-        units = ''.join([c for c in reversed(units)])
-    values = list(zip([second, minute, hour], units))
-    while not values[-1][0]:
-        values.pop()
+        units = units[::-1]
+    if sep is None:
+        sep = ' '
     if ms:
-        values[0] = ('%d.%d' % (values[0][0], ms), values[0][1])
-    return ' '.join(['%s%s' % v for v in reversed(values)])
+        last = '%d.%03d%s' % (second, ms, units[0])
+    else:
+        last = '%d%s' % (second, units[0])
+    if hour:
+        return '%d%s%s%d%s%s%s' % (hour, units[2], sep, minute, units[1],
+                                   sep, last)
+    if minute:
+        return '%d%s%s%s' % (minute, units[1], sep, last)
+    return last
 
 
 def group(lst, count):
@@ -271,14 +310,14 @@ def group(lst, count):
 
     From: http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/303060
     """
-    return list(zip(*[lst[i::count] for i in range(count)]))
+    return list(zip(*[iter(lst)]*count))
 
 
 def flatten(lst):
     """Flatten a list. See http://stackoverflow.com/questions/952914/\
            making-a-flat-list-out-of-list-of-lists-in-python
     """
-    return [item for sublist in lst for item in sublist]
+    return list(chain.from_iterable(lst))
 
 
 def file_generator(path, action, *args):
@@ -349,8 +388,7 @@ def configure_logging(verbosity, longfmt, logdest=None, loggers=None,
     dsthandler = None
     syslog = False
     if logdest and isinstance(logdest, str):
-        mo = match(r'^syslog://(?P<host>[^:]*)?(?::(?P<port>\d+))?'
-                   r'(?:/(?P<facility>\w+))?$', logdest)
+        mo = _SYSLOG_CRE.match(logdest)
         if mo:
             host = mo.group('host') or 'localhost'
             port = mo.group('port')
@@ -439,15 +477,18 @@ def configure_logging(verbosity, longfmt, logdest=None, loggers=None,
     return loglevel
 
 
-def seq2ranges(seq: Sequence[int]) -> Sequence[Tuple[int, int]]:
+def seq2ranges(seq: Sequence[int], already_sorted: bool = False) \
+        -> Sequence[Tuple[int, int]]:
     """Find continous ranges of integers in a list.isinstance
 
        :param seq: the sequence of integer to parse
+       :param already_sorted: whether the sequence is known to be sorted,
+                              so that it needs not be sorted again
        :return: a sequence of tuple of range of integers
     """
     ranges = []
     first = last = None
-    for item in sorted(seq):
+    for item in (seq if already_sorted else sorted(seq)):
         if not isinstance(item, int):
             raise TypeError('Sequence contains non-integer values')
         if first is None:
@@ -464,6 +505,20 @@ def seq2ranges(seq: Sequence[int]) -> Sequence[Tuple[int, int]]:
     return ranges
 
 
+@lru_cache(maxsize=256)
+def _split_version(version: str) -> Tuple[int]:
+    """Build a tuple-of-integer version from a dot-separated string.
+
+       Results are cached, as the same versions are usually tested over and
+       over.
+
+       :param version: the version string to convert
+       :return: the tuple-based version
+       :raise ValueError: if the string is not a valid version
+    """
+    return tuple(int(x) for x in version.split('.'))
+
+
 def _make_version(version: Union[str,int,Tuple[int]]) -> Tuple[int]:
     """Build a tuple-of-integer version from a string or a unique integer.
 
@@ -472,7 +527,7 @@ def _make_version(version: Union[str,int,Tuple[int]]) -> Tuple[int]:
     """
     try:
         if isinstance(version, str):
-            version = tuple(int(x) for x in version.split('.'))
+            version = _split_version(version)
         elif isinstance(version, int):
             version = (version, )
         elif isinstance(version, tuple):
@@ -496,10 +551,7 @@ def since(version: Union[str,int,Tuple[int]]):
     version = _make_version(version)
     def _version_decorator_(func):
         func._tde_min_version = version
-        @wraps(func)
-        def _func_wrapper_(self, *args, **kwargs):
-            return func(self, *args, **kwargs)
-        return _func_wrapper_
+        return func
     return _version_decorator_
 
 
@@ -514,10 +566,7 @@ def until(version: Union[str,int,Tuple[int]]):
     version = _make_version(version)
     def _version_decorator_(func):
         func._tde_max_version = version
-        @wraps(func)
-        def _func_wrapper_(self, *args, **kwargs):
-            return func(self, *args, **kwargs)
-        return _func_wrapper_
+        return func
     return _version_decorator_
 
 
@@ -538,12 +587,12 @@ def version_match(obj: Any, version: Union[str,int,Tuple[int]]) -> bool:
        :return: True if version match, False otherwise
     """
     version = _make_version(version)
-    if hasattr(obj, '_tde_min_version'):
-        if version < obj._tde_min_version:
-            return False
-    if hasattr(obj, '_tde_max_version'):
-        if version >= obj._tde_max_version:
-            return False
+    min_version = getattr(obj, '_tde_min_version', None)
+    if min_version is not None and version < min_version:
+        return False
+    max_version = getattr(obj, '_tde_max_version', None)
+    if max_version is not None and version >= max_version:
+        return False
     return True
 
 def get_time_logger(name: Optional[str] = None):
@@ -628,29 +677,52 @@ class EasyDict(dict):
 
     def __init__(self, dictionary=None, **kwargs):
         if dictionary is not None:
-            self.update(dictionary)
-        self.update(kwargs)
+            dict.update(self, dictionary)
+        dict.update(self, kwargs)
 
     def __getattr__(self, name):
-        try:
-            return self.__getitem__(name)
-        except KeyError:
+        value = dict.get(self, name, _MISSING)
+        if value is _MISSING:
             raise AttributeError("'%s' object has no attribute '%s'" %
                                  (self.__class__.__name__, name))
+        return value
 
     def __setattr__(self, name, value):
-        self.__setitem__(name, value)
+        dict.__setitem__(self, name, value)
 
     @classmethod
     def copy(cls, dictionary):
 
-        def _deep_copy(obj):
+        def _copy(obj, factory=EasyDict):
+            # containers are created empty, and filled in once popped from
+            # the pending stack, so that deep trees need no recursion.
+            # As with deepcopy, the memo maps the id of each container to
+            # its copy, so that shared or self-referencing containers are
+            # only copied once
+            if type(obj) in _IMMUTABLE_TYPES:
+                return obj
+            copy = memo.get(id(obj), _MISSING)
+            if copy is not _MISSING:
+                return copy
             if isinstance(obj, list):
-                return [_deep_copy(v) for v in obj]
-            if isinstance(obj, dict):
-                return EasyDict({k: _deep_copy(obj[k]) for k in obj})
-            return deepcopy(obj)
-        return cls(_deep_copy(dictionary))
+                copy = [None] * len(obj)
+                pending.append((copy, enumerate(obj)))
+            elif isinstance(obj, dict):
+                copy = factory()
+                pending.append((copy, obj.items()))
+            else:
+                return deepcopy(obj, memo)
+            memo[id(obj)] = copy
+            return copy
+
+        memo = {}
+        pending = []
+        top = _copy(dictionary, cls)
+        while pending:
+            copy, items = pending.pop()
+            for key, value in items:
+                copy[key] = _copy(value)
+        return top
 
     def mirror(self) -> 'EasyDict':
         """Instanciate a mirror EasyDict."""
@@ -725,6 +797,9 @@ class FixedArray(list):
 
     FixedBoundError = IndexError('Out of bound')
 
+    IMMUTABLE_TYPES = _IMMUTABLE_TYPES
+    """Item types whose values need not be copied"""
+
     LOCK = Lock()
     VARIANTS = {}
 
@@ -737,6 +812,10 @@ class FixedArray(list):
            :param size: the count of stored values
         """
         kind = (type_, size)
+        # dict reads are atomic, the lock is only required to create a type
+        variant = cls.VARIANTS.get(kind)
+        if variant is not None:
+            return variant
         with cls.LOCK:
             if kind not in cls.VARIANTS:
                 name = ''.join((cls.__name__, '%d' % size, '_',
@@ -744,7 +823,7 @@ class FixedArray(list):
                 newtype = type(name, (FixedArray, ),
                                {'SIZE': size, 'TYPE': type_})
                 cls.VARIANTS[kind] = newtype
-        return cls.VARIANTS[kind]
+            return cls.VARIANTS[kind]
 
     def __init__(self, arg=None):
         if arg is None:
@@ -769,6 +848,8 @@ class FixedArray(list):
         raise IndexError()
 
     def __deepcopy__(self, memo):
+        if self.TYPE in self.IMMUTABLE_TYPES:
+            return self.__class__(list(self))
         items = []
         for item in self:
             item = deepcopy(item, memo)
@@ -803,7 +884,7 @@ class FixedArray(list):
         else:
             if key >= self.SIZE:
                 raise self.FixedBoundError
-            self._check_value_type([value])
+            self._check_value_type((value,))
         super(FixedArray, self).__setitem__(key, value)
 
     def duplicate(self):
@@ -820,12 +901,14 @@ class FixedArray(list):
         raise IndexError()
 
     def _check_value_type(self, values: Iterable):
-        if not self.TYPE:
+        type_ = self.TYPE
+        if not type_:
             return
+        # a plain loop is faster than all() with a generator or map()
         for val in values:
-            if not isinstance(val, self.TYPE):
+            if not isinstance(val, type_):
                 raise TypeError('Value %s not of type %s' %
-                                (val, self.TYPE.__name__))
+                                (val, type_.__name__))
 
 # pylint: enable-msg=invalid-name,no-member,no-self-use
 
@@ -839,6 +922,13 @@ class BitfieldDecoder:
 
     def __init__(self, decmap):
         self._map = decmap
+        # decoding entries, from the most significant bitfield down, with
+        # the negated name of boolean fields, or None for valued fields
+        self._entries = tuple(
+            (bits, offset, name, values,
+             '/%s' % name.lower() if isinstance(values, bool) else None)
+            for (bits, offset), (name, values) in
+            sorted(decmap.items(), reverse=True))
 
     @classmethod
     def from_range(cls, bitfield: Mapping[Union[int, Tuple[int, int]],
@@ -877,14 +967,14 @@ class BitfieldDecoder:
         decmap = {}
         chunk = 0
         for bitchunk, desc in valmap.items():
-            if not isinstance(bitchunk, int) or not bitchunk:
+            if not isinstance(bitchunk, int) or bitchunk <= 0:
                 raise ValueError('Invalid value: %s' % bitchunk)
-            bitchars = '{:032b}'.format(bitchunk).lstrip('0')
-            roffset = bitchars.rindex('1')
-            offset = len(bitchars)-roffset-1
-            ones = bitchars[:roffset+1]
-            if '0' in ones:
-                raise ValueError('Non-consecutive bits: $s' % bitchunk)
+            # position of the lowest bit set
+            offset = (bitchunk & -bitchunk).bit_length() - 1
+            # once shifted, consecutive bits are a power of 2 minus one
+            ones = bitchunk >> offset
+            if ones & (ones + 1):
+                raise ValueError('Non-consecutive bits: %s' % bitchunk)
             if bitchunk & chunk:
                 raise ValueError('Overlapping bits')
             chunk |= bitchunk
@@ -900,13 +990,12 @@ class BitfieldDecoder:
            :return: a sequence of decoded (name, values)
         """
         output = []
-        for (bits, offset), (name, values) in \
-                reversed(sorted(self._map.items())):
+        for bits, offset, name, values, negname in self._entries:
             bitval = (value & bits) >> offset
             if include_all or bitval:
-                if isinstance(values, bool):
-                    is_set = not xor(bool(bitval), values)
-                    output.append(name if is_set else '/%s' % name.lower())
+                if negname is not None:
+                    is_set = (bitval != 0) == values
+                    output.append(name if is_set else negname)
                 else:
                     output.append((name, values[bitval]))
         return output
@@ -2,7 +2,7 @@
 """
 
 from array import array as Array
-from binascii import hexlify, unhexlify
+from binascii import unhexlify
 from io import BytesIO, StringIO
 from os import stat, linesep, SEEK_END, SEEK_SET
 from re import compile as re_compile
@@ -560,7 +560,7 @@ class SRecBuilder(RecordBuilder):
     def _create_info(cls, segment):
         msg = segment.data[:16]
         line = 'S0%02X%04X' % (len(msg)+2+1, 0)
-        line += hexlify(msg)
+        line += msg.hex()
         line += "%02x" % SRecBuilder.checksum(line[2:])
         return line.upper()
 
@@ -576,7 +576,7 @@ class SRecBuilder(RecordBuilder):
             prefix = 'S3%02x%08x'
         for pos in range(0, len(data), 16):
             chunk = data[pos:pos+16]
-            hexachunk = hexlify(chunk).decode()
+            hexachunk = chunk.hex()
             line = prefix % (len(chunk) + int(prefix[1])+1 + 1,
                              offset + segment.baseaddr) + hexachunk
             line += "%02x" % SRecBuilder.checksum(line[2:])
@@ -648,7 +648,7 @@ class IHexBuilder(RecordBuilder):
     def _create_line(cls, type_, address=0, data=None):
         if not data:
             data = b''
-        hexdat = hexlify(data).decode()
+        hexdat = data.hex()
         length = len(data)
         datastr = '%02X%04X%02X%s' % (length, address, type_, hexdat)
         checksum = cls.checksum(datastr)
@@ -667,7 +667,7 @@ class TItxtBuilder(RecordBuilder):
             yield '@%04x' % (segment.baseaddr + offset)
         for pos in range(0, len(data), 16):
             chunk = data[pos:pos+16]
-            line = ' '.join(['%02x' % b for b in chunk])
+            line = chunk.hex(' ')
             yield line.upper()
 
     @classmethod